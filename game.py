@@ -1,19 +1,36 @@
 import asyncio
-import json
-import uuid
+import base64
+import orjson
+import time
+from collections import deque
 from dataclasses import dataclass, field
 from fastapi import WebSocket
 
 import gemini_service
 
+# Invariant frames serialized once so the send path is a plain socket write
+_WAITING = orjson.dumps({"type": "waiting"})
+_JOINED = {
+    1: orjson.dumps({"type": "joined", "player_id": 1, "players_in_room": 2}),
+    2: orjson.dumps({"type": "joined", "player_id": 2, "players_in_room": 2}),
+}
+_BOTH_JOINED = {
+    1: orjson.dumps({"type": "both_joined", "player_id": 1}),
+    2: orjson.dumps({"type": "both_joined", "player_id": 2}),
+}
+_OPPONENT_READY = orjson.dumps({"type": "opponent_ready"})
+_OPPONENT_CHARACTER_READY = orjson.dumps({"type": "opponent_character_ready"})
+_OPPONENT_DISCONNECTED = orjson.dumps({"type": "opponent_disconnected"})
+
 
 @dataclass
 class Player:
     ws: WebSocket | None
     player_id: int
-    image_data: str | None = None
+    image_bytes: bytes | None = None
     character: dict | None = None
     ready: bool = False
+    image_task: asyncio.Task | None = None
 
 
 @dataclass
@@ -22,25 +39,76 @@ class Room:
     players: dict[int, Player] = field(default_factory=dict)
     state: str = "waiting"  # waiting, playing, finished
     _next_id: int = 1
+    created_at: float = field(default_factory=time.monotonic)
 
 
 class RoomManager:
     def __init__(self):
         self.rooms: dict[str, Room] = {}
-        self._waiting: Player | None = None
-        self._waiting_event: asyncio.Event | None = None
+        # FIFO of (player, future) waiters; the matcher pops the oldest and
+        # resolves its future with the new room
+        self._waiters: deque[tuple[Player, asyncio.Future]] = deque()
+        self._ai_pool: asyncio.Queue[dict] = asyncio.Queue(maxsize=4)
+        self._ai_pool_task: asyncio.Task | None = None
+        self._gc_task: asyncio.Task | None = None
+        self._room_counter = 0
+
+    def _next_room_id(self) -> str:
+        # Room ids are internal dict keys; a counter is collision-free and
+        # avoids the os.urandom draw + UUID allocation per match
+        self._room_counter += 1
+        return f"{self._room_counter:08x}"
+
+    def start(self):
+        """Launch background tasks. Called once from app startup."""
+        if self._ai_pool_task is None:
+            self._ai_pool_task = asyncio.create_task(self._refill_ai_pool())
+        if self._gc_task is None:
+            self._gc_task = asyncio.create_task(self._gc_rooms())
+
+    async def _gc_rooms(self):
+        # Disconnect cleanup can miss rooms when both sockets die without a
+        # close frame; sweep periodically so stale rooms (and the large
+        # character image data-URLs they hold) don't accumulate
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for room_id, room in list(self.rooms.items()):
+                stale = (
+                    not room.players
+                    or (room.state == "finished" and now - room.created_at > 300)
+                )
+                if stale:
+                    self.rooms.pop(room_id, None)
+
+    async def _refill_ai_pool(self):
+        # Keep a small stock of pre-generated AI opponents so a timed-out
+        # waiter doesn't pay the cold Gemini round-trip
+        while True:
+            try:
+                char = await gemini_service.generate_random_character()
+                try:
+                    char["image"] = await gemini_service.generate_character_image(char)
+                except Exception:
+                    pass
+                await self._ai_pool.put(char)
+            except Exception:
+                await asyncio.sleep(5)
+
+    def _remove_waiter(self, entry: tuple[Player, asyncio.Future]):
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            pass
 
     async def handle_connection(self, ws: WebSocket):
         await ws.accept()
 
-        # If someone is already waiting, match immediately
-        if self._waiting is not None:
-            partner = self._waiting
-            waiting_event = self._waiting_event
-            self._waiting = None
-            self._waiting_event = None
+        # If someone is already waiting, match with the oldest waiter
+        if self._waiters:
+            partner, partner_fut = self._waiters.popleft()
 
-            room_id = uuid.uuid4().hex[:8]
+            room_id = self._next_room_id()
             room = Room(room_id=room_id)
             self.rooms[room_id] = room
 
@@ -50,19 +118,13 @@ class RoomManager:
             player = Player(ws=ws, player_id=2)
             room.players[2] = player
 
-            # Signal the waiting player that they've been matched.
-            # Their inline waiting loop will exit and they'll start
-            # their own _run_player.
-            if waiting_event:
-                waiting_event.set()
+            # Wake the waiting player; their inline waiting loop will exit
+            # and they'll start their own _run_player.
+            partner_fut.set_result(room)
 
             # Notify both — handle partner disconnect gracefully
             try:
-                await partner.ws.send_json({
-                    "type": "joined",
-                    "player_id": 1,
-                    "players_in_room": 2,
-                })
+                await partner.ws.send_bytes(_JOINED[1])
             except Exception:
                 # Partner's connection is dead, fall back to AI for this player
                 room.players.pop(1, None)
@@ -70,18 +132,11 @@ class RoomManager:
                 await self._start_ai_battle(player, ws)
                 return
 
-            await ws.send_json({
-                "type": "joined",
-                "player_id": 2,
-                "players_in_room": 2,
-            })
+            await ws.send_bytes(_JOINED[2])
             for p in room.players.values():
                 if p.ws is not None:
                     try:
-                        await p.ws.send_json({
-                            "type": "both_joined",
-                            "player_id": p.player_id,
-                        })
+                        await p.ws.send_bytes(_BOTH_JOINED[p.player_id])
                     except Exception:
                         pass
 
@@ -91,33 +146,29 @@ class RoomManager:
             await self._run_player(room, player)
             return
 
-        # No one waiting — this player waits
+        # No one waiting — this player joins the waiter queue
         player = Player(ws=ws, player_id=0)
-        self._waiting = player
-        event = asyncio.Event()
-        self._waiting_event = event
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        entry = (player, fut)
+        self._waiters.append(entry)
 
-        await ws.send_json({
-            "type": "waiting",
-        })
+        await ws.send_bytes(_WAITING)
 
         # Wait for match, skip, or timeout (30s).
         # Single inline loop — no separate task, no concurrent WebSocket readers.
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         deadline = loop.time() + 30.0
         skip_requested = False
         disconnected = False
 
-        while not event.is_set():
+        while not fut.done():
             remaining = deadline - loop.time()
             if remaining <= 0:
                 break
             try:
-                data = await asyncio.wait_for(
-                    ws.receive_text(),
-                    timeout=min(remaining, 1.0),
-                )
-                msg = json.loads(data)
+                async with asyncio.timeout(min(remaining, 1.0)):
+                    data = await ws.receive_text()
+                msg = orjson.loads(data)
                 if msg.get("type") == "skip":
                     skip_requested = True
                     break
@@ -129,44 +180,26 @@ class RoomManager:
                 break
 
         if disconnected:
-            if self._waiting is player:
-                self._waiting = None
-                self._waiting_event = None
+            self._remove_waiter(entry)
+            if fut.done():
+                # Matched just as the connection dropped; run the normal
+                # loop so the partner gets the disconnect notification
+                await self._run_player(fut.result(), player)
             return
 
-        matched_by_opponent = (
-            not skip_requested
-            and self._waiting is not player
-        )
-
-        if not matched_by_opponent:
+        if not fut.done() or skip_requested:
             # No opponent found or skip — create AI opponent
-            if self._waiting is player:
-                self._waiting = None
-                self._waiting_event = None
-
+            self._remove_waiter(entry)
+            fut.cancel()
             await self._start_ai_battle(player, ws)
             return
 
-        # Matched! Find which room this player was placed in
-        room = None
-        for r in self.rooms.values():
-            if player.player_id in [
-                p.player_id
-                for p in r.players.values()
-                if p.ws is player.ws
-            ]:
-                room = r
-                break
-
-        if room is None:
-            await ws.close()
-            return
-
+        # Matched! The matcher resolved our future with the room
+        room = fut.result()
         await self._run_player(room, player)
 
     async def _start_ai_battle(self, player: Player, ws: WebSocket):
-        room_id = uuid.uuid4().hex[:8]
+        room_id = self._next_room_id()
         room = Room(room_id=room_id)
         self.rooms[room_id] = room
 
@@ -179,50 +212,89 @@ class RoomManager:
         room.players[2] = ai_player
 
         # Send to camera immediately
-        await ws.send_json({
-            "type": "joined",
-            "player_id": 1,
-            "players_in_room": 2,
-        })
-        await ws.send_json({
-            "type": "both_joined",
-            "player_id": 1,
-        })
+        await ws.send_bytes(_JOINED[1])
+        await ws.send_bytes(_BOTH_JOINED[1])
 
-        # Generate AI character in background while player takes photo
-        async def gen_ai_character():
-            try:
-                ai_char = await gemini_service.generate_random_character()
-            except Exception:
-                ai_char = {
-                    "name": "謎の挑戦者",
-                    "hp": 120, "attack": 60, "defense": 50, "speed": 55,
-                    "special_move": "ミステリアスブロー",
-                    "attribute": "打撃", "power": 50,
-                    "description": "正体不明の挑戦者。油断はできない。",
-                }
-            try:
-                ai_image = await gemini_service.generate_character_image(ai_char)
-                ai_char["image"] = ai_image
-            except Exception:
-                pass
-            ai_player.character = ai_char
+        # Prefer a pre-generated AI character from the pool; if it's empty,
+        # fall back to generating in the background while the player takes
+        # their photo
+        try:
+            ai_player.character = self._ai_pool.get_nowait()
+        except asyncio.QueueEmpty:
+            async def gen_ai_character():
+                try:
+                    ai_char = await gemini_service.generate_random_character()
+                except Exception:
+                    ai_char = {
+                        "name": "謎の挑戦者",
+                        "hp": 120, "attack": 60, "defense": 50, "speed": 55,
+                        "special_move": "ミステリアスブロー",
+                        "attribute": "打撃", "power": 50,
+                        "description": "正体不明の挑戦者。油断はできない。",
+                    }
+                try:
+                    ai_image = await gemini_service.generate_character_image(ai_char)
+                    ai_char["image"] = ai_image
+                except Exception:
+                    pass
+                ai_player.character = ai_char
 
-        asyncio.create_task(gen_ai_character())
+            asyncio.create_task(gen_ai_character())
 
         await self._run_player(room, player)
 
     async def _run_player(self, room: Room, player: Player):
-        try:
+        # Bounded queue between receive and handling: a client that sends
+        # faster than we process (handle_message can sit in Gemini calls for
+        # seconds) blocks on the WebSocket instead of stacking up unbounded
+        # in-flight work
+        queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=1)
+
+        async def recv_loop():
             while True:
                 data = await player.ws.receive_text()
-                msg = json.loads(data)
+                msg = orjson.loads(data)
+                if msg.get("type") == "image_submit" and not queue.empty():
+                    # A submit is already queued; drop the duplicate
+                    continue
+                await queue.put(msg)
+
+        async def handler_loop():
+            while True:
+                msg = await queue.get()
                 await self.handle_message(room, player, msg)
-        except Exception:
-            pass
+                # Let other connections run between messages
+                await asyncio.sleep(0)
+
+        recv_task = asyncio.create_task(recv_loop())
+        handler_task = asyncio.create_task(handler_loop())
+        try:
+            done, pending = await asyncio.wait(
+                {recv_task, handler_task},
+                return_when=asyncio.FIRST_EXCEPTION,
+            )
+            for task in pending:
+                task.cancel()
+            for task in done:
+                task.exception()  # swallow, as the old blanket except did
         finally:
+            recv_task.cancel()
+            handler_task.cancel()
             await self._handle_disconnect(room, player)
 
+    async def _broadcast(self, room: Room, payload: bytes, exclude_id: int | None = None):
+        """Send payload to every connected player in the room concurrently.
+
+        Send failures are ignored, matching the old per-send try/except.
+        """
+        sends = [
+            p.ws.send_bytes(payload)
+            for p in room.players.values()
+            if p.ws is not None and p.player_id != exclude_id
+        ]
+        if sends:
+            await asyncio.gather(*sends, return_exceptions=True)
+
     async def handle_message(self, room: Room, player: Player, msg: dict):
         msg_type = msg.get("type")
 
@@ -232,67 +304,75 @@ class RoomManager:
             await self._handle_ready(room, player)
 
     async def _handle_image_submit(self, room: Room, player: Player, msg: dict):
-        player.image_data = msg.get("image_data", "")
-
         try:
-            # Step 1: Analyze the object in the image (attribute & power)
-            object_info = await gemini_service.analyze_object(player.image_data)
-
-            # Step 2: Generate character using object analysis as context
-            character = await gemini_service.analyze_image(
-                player.image_data, object_info=object_info
-            )
+            # Decode the data-URL once here; everything downstream works on
+            # the raw JPEG bytes instead of re-decoding the base64 string.
+            # The decode is several ms for a big photo, so keep it off the
+            # loop. Malformed payloads fall through to the error frame below
+            image_data = msg.get("image_data", "")
+            if "," in image_data:
+                image_data = image_data.split(",", 1)[1]
+            player.image_bytes = await asyncio.to_thread(base64.b64decode, image_data)
+
+            # Analyze the object and generate the character in one Gemini call
+            analysis = await gemini_service.analyze_image_and_object(player.image_bytes)
+            character = analysis.get("character") or {}
 
             # Ensure attribute and power are included in the character
             if "attribute" not in character:
-                character["attribute"] = object_info.get("attribute", "打撃")
+                character["attribute"] = analysis.get("attribute", "打撃")
             if "power" not in character:
-                character["power"] = object_info.get("power", 50)
+                character["power"] = analysis.get("power", 50)
 
-            # Generate character image in parallel-ish: send stats first, then image
-            await player.ws.send_json({
+            # Send stats first; the illustration is generated in the
+            # background so it overlaps the opponent's photo capture
+            await player.ws.send_bytes(orjson.dumps({
                 "type": "character_generated",
                 "character": character,
-            })
-
-            # Generate character illustration
-            try:
-                image_data_url = await gemini_service.generate_character_image(character)
-                character["image"] = image_data_url
-                await player.ws.send_json({
-                    "type": "character_image",
-                    "image": image_data_url,
-                })
-            except Exception:
-                # Image generation is optional; continue without it
-                pass
+            }))
 
             player.character = character
+            player.image_task = asyncio.create_task(
+                self._finish_character_image(player, character)
+            )
 
             # Notify opponent that this player's character is ready
-            for p in room.players.values():
-                if p.player_id != player.player_id and p.ws is not None:
-                    try:
-                        await p.ws.send_json({"type": "opponent_character_ready"})
-                    except Exception:
-                        pass
+            await self._broadcast(
+                room, _OPPONENT_CHARACTER_READY, exclude_id=player.player_id
+            )
+
+            # The image bytes are no longer needed; free them early
+            player.image_bytes = None
 
         except Exception as e:
-            await player.ws.send_json({
+            await player.ws.send_bytes(orjson.dumps({
                 "type": "error",
                 "message": f"キャラクター生成に失敗しました: {str(e)}",
-            })
+            }))
 
-    async def _handle_ready(self, room: Room, player: Player):
-        player.ready = True
+    async def _finish_character_image(self, player: Player, character: dict):
+        try:
+            image_data_url = await gemini_service.generate_character_image(character)
+            character["image"] = image_data_url
+            if player.ws is not None:
+                await player.ws.send_bytes(orjson.dumps({
+                    "type": "character_image",
+                    "image": image_data_url,
+                }))
+        except Exception:
+            # Image generation is optional; continue without it
+            pass
 
+    async def _handle_ready(self, room: Room, player: Player):
         # Notify opponent
-        for p in room.players.values():
-            if p.player_id != player.player_id and p.ws is not None:
-                try:
-                    await p.ws.send_json({"type": "opponent_ready"})
-                except Exception:
-                    pass
+        await self._broadcast(room, _OPPONENT_READY, exclude_id=player.player_id)
+
+        # Only count as ready once the illustration is done — otherwise the
+        # opponent's handler could start the battle without this player's
+        # image, and this handler would start it again after the await
+        if player.image_task is not None:
+            await player.image_task
+        player.ready = True
 
         # Check if both players are ready
         all_ready = (
@@ -303,27 +383,30 @@ class RoomManager:
             await self._start_battle(room)
 
     async def _start_battle(self, room: Room):
+        if room.state != "waiting":
+            return
         room.state = "playing"
 
-        players = list(room.players.values())
-        p1, p2 = players[0], players[1]
+        p1, p2 = room.players.values()
 
-        for p in room.players.values():
-            if p.ws is not None:
-                try:
-                    await p.ws.send_json({
-                        "type": "battle_start",
-                        "player1": {"player_id": p1.player_id, "character": p1.character},
-                        "player2": {"player_id": p2.player_id, "character": p2.character},
-                    })
-                except Exception:
-                    pass
+        # Serialize once; the payload embeds both characters' image
+        # data-URLs, so re-encoding per player is tens of KB of wasted CPU
+        start_bytes = orjson.dumps({
+            "type": "battle_start",
+            "player1": {"player_id": p1.player_id, "character": p1.character},
+            "player2": {"player_id": p2.player_id, "character": p2.character},
+        })
+        await self._broadcast(room, start_bytes)
 
         try:
-            result, _ = await asyncio.gather(
-                gemini_service.resolve_battle(p1.character, p2.character),
-                asyncio.sleep(5),
-            )
+            started = time.monotonic()
+            result = await gemini_service.resolve_battle(p1.character, p2.character)
+
+            # Keep a short minimum so the client's battle animation isn't
+            # cut off, but don't pad fast resolutions to a fixed 5s floor
+            elapsed = time.monotonic() - started
+            if elapsed < 2.0:
+                await asyncio.sleep(2.0 - elapsed)
 
             winner_player_id = p1.player_id if result["winner"] == 1 else p2.player_id
 
@@ -342,34 +425,19 @@ class RoomManager:
             }
 
             room.state = "finished"
-            for p in room.players.values():
-                if p.ws is not None:
-                    try:
-                        await p.ws.send_json(battle_result)
-                    except Exception:
-                        pass
+            await self._broadcast(room, orjson.dumps(battle_result))
 
         except Exception as e:
-            for p in room.players.values():
-                if p.ws is not None:
-                    try:
-                        await p.ws.send_json({
-                            "type": "error",
-                            "message": f"バトル処理に失敗しました: {str(e)}",
-                        })
-                    except Exception:
-                        pass
+            await self._broadcast(room, orjson.dumps({
+                "type": "error",
+                "message": f"バトル処理に失敗しました: {str(e)}",
+            }))
 
     async def _handle_disconnect(self, room: Room, player: Player):
         room.players.pop(player.player_id, None)
 
         # Notify remaining player
-        for p in room.players.values():
-            if p.ws is not None:
-                try:
-                    await p.ws.send_json({"type": "opponent_disconnected"})
-                except Exception:
-                    pass
+        await self._broadcast(room, _OPPONENT_DISCONNECTED)
 
         # Clean up empty rooms
         if not room.players:
@@ -1,165 +1,441 @@
 import base64
-import json
+import copy
+import hashlib
 import asyncio
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from io import BytesIO
+import httpx
+import orjson
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from PIL import Image
+from pydantic import BaseModel, Field
 
 client: genai.Client | None = None
 MODEL = "gemini-2.5-flash"
 IMAGE_MODEL = "gemini-2.5-flash-image"
+EMBEDDING_MODEL = "text-embedding-004"
 
+# Static prompt bodies built once at import; only the truly dynamic
+# segments are formatted per call
+_ANALYZE_PROMPT = """あなたは対象物の本質を見抜く鑑定眼を持ったAIです。
+この画像には、人が手に何かを持ってカメラに見せている様子が映っています。
+人物の説明は一切不要です。
 
-def init_client(api_key: str):
-    global client
-    client = genai.Client(api_key=api_key)
-
-
-async def analyze_object(image_base64: str) -> dict:
-    """Analyze a camera image to detect the object and classify it as a weapon attribute."""
-    if client is None:
-        raise RuntimeError("Gemini client not initialized")
+【ステップ1: 鑑定】
+見せている「物体」を【戦闘での武器】として使った場合を想定し、その属性の強さを示す「パワー」（0〜100）と、「属性」を分析してください。
+属性は必ず以下の4つの中から、最もふさわしいものを1つだけ選んでください。それ以外の属性は絶対に使わないでください。
+- 斬撃
+- 打撃
+- 盾
+- 毒
 
-    if "," in image_base64:
-        image_base64 = image_base64.split(",", 1)[1]
+【ステップ2: キャラクター生成】
+ステップ1の鑑定結果を元に、バトルゲームのキャラクターを生成してください。
+- キャラクターの名前は物体名をベースにした創造的な名前にしてください（日本語）
+- 属性を活かした必殺技にしてください（必殺技名も日本語）
+- パワーを反映したステータス配分にしてください（パワーが高いほど強い）
+- キャラクターの説明は2-3文の日本語で、元の物体と属性について触れてください
+- ステータスの合計は250-400の範囲にしてください
+- キャラクターのattributeとpowerは鑑定結果と同じ値にしてください"""
 
-    image_bytes = base64.b64decode(image_base64)
+_IMAGE_PROMPT_RULES = """【絶対に守るルール】
+- 文字、テキスト、ロゴ、名前、数字、記号は一切描かないでください
+- キャラクターのみを描いてください
+- 背景はシンプルな単色グラデーションにしてください
+- アニメ・ゲーム風の迫力あるポーズで描いてください
+- 正方形の構図で、キャラクターを画面中央に大きく配置してください"""
 
-    prompt = """あなたは対象物の本質を見抜く鑑定眼を持ったAIです。
-この画像には、人が手に何かを持ってカメラに見せている様子が映っています。
-人物の説明は一切不要です。見せている「物体」を【戦闘での武器】として使った場合を想定し、その属性の強さを示す「パワー」（0〜100）と、「属性」を分析してください。
+_RANDOM_CHARACTER_PROMPT = """ランダムなバトルゲームのキャラクターを1体生成してください。
+創造的でユニークなキャラクターにしてください。
 
-【重要】
-属性は必ず以下の4つの中から、最もふさわしいものを1つだけ選んでください。それ以外の属性は絶対に使わないでください。
+属性は必ず以下の4つの中から1つ選んでください:
 - 斬撃
 - 打撃
 - 盾
 - 毒
 
-また、その物体が何であるかを簡潔に説明してください。
+- 名前・必殺技・説明は日本語にしてください
+- 説明は2-3文にしてください
+- パワーは30-90の範囲にしてください
+- ステータスの合計は250-400の範囲にしてください"""
+
+
+# Structured-output schemas: Gemini guarantees conforming JSON, so the
+# prompts no longer spell out the format and the model emits no scaffolding
+class Character(BaseModel):
+    name: str
+    hp: int = Field(ge=50, le=200)
+    attack: int = Field(ge=10, le=100)
+    defense: int = Field(ge=10, le=100)
+    speed: int = Field(ge=10, le=100)
+    special_move: str
+    attribute: str
+    power: int = Field(ge=0, le=100)
+    description: str
+
+
+class ObjectAnalysis(BaseModel):
+    object_name: str
+    attribute: str
+    power: int = Field(ge=0, le=100)
+    character: Character
+
+
+class BattleResult(BaseModel):
+    winner: int
+    reason: str
+
+# LRU cache of analysis results keyed by image hash, plus an in-flight map
+# so concurrent submissions of the same image share one Gemini request
+_ANALYSIS_CACHE_MAX = 512
+_analysis_cache: OrderedDict[bytes, dict] = OrderedDict()
+_analysis_inflight: dict[bytes, asyncio.Future] = {}
+
+# In-flight map so duplicate illustration requests for the same character
+# share one Gemini image-generation call
+_image_inflight: dict[bytes, asyncio.Future] = {}
+
+# Exact-match response cache (prompt-keyed, TTL'd) for battle resolution,
+# so re-resolving the same character pair skips the round-trip
+_RESPONSE_CACHE_MAX = 512
+_RESPONSE_CACHE_TTL = 1800.0
+_response_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+
+def _response_cache_get(key: str) -> dict | None:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, value = entry
+    if time.monotonic() - stored_at > _RESPONSE_CACHE_TTL:
+        _response_cache.pop(key, None)
+        return None
+    _response_cache.move_to_end(key)
+    return value
+
+
+def _response_cache_put(key: str, value: dict):
+    _response_cache[key] = (time.monotonic(), value)
+    if len(_response_cache) > _RESPONSE_CACHE_MAX:
+        _response_cache.popitem(last=False)
+
+
+# Semantic cache for character illustrations: characters whose name, move,
+# and description embed near an already-generated one reuse that image
+# instead of paying the image model again
+_IMAGE_CACHE_MAX = 1024
+_IMAGE_CACHE_THRESHOLD = 0.95
+_image_cache: OrderedDict[bytes, tuple[list[float], str]] = OrderedDict()
+
+
+async def _embed_character(character: dict) -> list[float] | None:
+    """Embed the character's descriptive fields; None if embedding fails."""
+    text = "|".join(
+        str(character.get(k, ""))
+        for k in ("name", "special_move", "description")
+    )
+    try:
+        response = await client.aio.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=text,
+        )
+        vec = list(response.embeddings[0].values)
+    except Exception:
+        return None
+    norm = math.sqrt(sum(x * x for x in vec))
+    if norm == 0:
+        return None
+    return [x / norm for x in vec]
+
+
+def _image_cache_lookup(embedding: list[float]) -> str | None:
+    # Vectors are stored normalized, so cosine similarity is a plain dot
+    # product; a linear scan over <=1024 entries is microseconds
+    best_key = None
+    best_score = _IMAGE_CACHE_THRESHOLD
+    for key, (vec, _) in _image_cache.items():
+        score = sum(a * b for a, b in zip(embedding, vec))
+        if score >= best_score:
+            best_score = score
+            best_key = key
+    if best_key is None:
+        return None
+    _image_cache.move_to_end(best_key)
+    return _image_cache[best_key][1]
+
+
+def _image_cache_put(key: bytes, embedding: list[float], image: str):
+    _image_cache[key] = (embedding, image)
+    if len(_image_cache) > _IMAGE_CACHE_MAX:
+        _image_cache.popitem(last=False)
+
+
+# Gemini tokenizes images in fixed tiles, so resolution beyond ~768px only
+# costs input tokens and upload bandwidth
+_MAX_IMAGE_EDGE = 768
+
+
+def _normalize_image(image_bytes: bytes) -> bytes:
+    """Downscale to the max edge and re-encode as JPEG quality 80.
+
+    CPU-bound; callers run this via asyncio.to_thread.
+    """
+    img = Image.open(BytesIO(image_bytes)).convert("RGB")
+    img.thumbnail((_MAX_IMAGE_EDGE, _MAX_IMAGE_EDGE), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=80, optimize=True)
+    return buf.getvalue()
 
-以下のJSON形式でのみ出力してください。
-{
-    "object_name": "物体の名前",
-    "attribute": "属性名",
-    "power": 85
-}"""
 
+def _parse_and_validate(text: str, required_keys: tuple[str, ...] = ()) -> dict:
+    """Parse a Gemini JSON response and check the expected keys exist.
+
+    Raises ValueError (which _retry treats as retryable) on malformed or
+    incomplete output, so a bad response fails into the retry path
+    instead of surfacing a KeyError downstream.
+    """
+    result = orjson.loads(text)
+    if not isinstance(result, dict):
+        raise ValueError(f"expected JSON object, got {type(result).__name__}")
+    missing = [key for key in required_keys if key not in result]
+    if missing:
+        raise ValueError(f"response missing keys: {missing}")
+    return result
+
+
+# API error codes worth retrying (rate limit and transient server errors)
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+# Cap concurrent Gemini calls so connection bursts queue here instead of
+# turning into 429s and retries; the image model has tighter rate limits,
+# so it gets its own smaller gate
+_text_gate = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")))
+_image_gate = asyncio.Semaphore(int(os.getenv("GEMINI_IMAGE_MAX_CONCURRENCY", "4")))
+
+
+async def _retry(attempt_fn, gate: asyncio.Semaphore | None = None,
+                 max_retries: int = 3, base: float = 1.0,
+                 cap: float = 30.0, jitter: float = 0.5):
+    """Run attempt_fn with exponential backoff and jitter.
+
+    Retries recoverable API errors (429/5xx) and malformed model output
+    (ValueError); everything else is raised immediately. The old fixed
+    1-second sleep made concurrent failures re-fire in lockstep. A gate
+    bounds how many attempts run concurrently; it's released during the
+    backoff sleeps.
+    """
     last_error = None
-    for attempt in range(3):
+    for attempt in range(max_retries):
         try:
-            response = await client.aio.models.generate_content(
-                model=MODEL,
-                contents=[
-                    types.Content(
-                        parts=[
-                            types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
-                            types.Part.from_text(text=prompt),
-                        ]
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.9,
-                ),
-            )
-            return json.loads(response.text)
-        except Exception as e:
+            if gate is not None:
+                async with gate:
+                    return await attempt_fn()
+            return await attempt_fn()
+        except errors.APIError as e:
+            if getattr(e, "code", None) not in _RETRYABLE_CODES:
+                raise
+            last_error = e
+        except ValueError as e:
             last_error = e
-            if attempt < 2:
-                await asyncio.sleep(1)
+        if attempt < max_retries - 1:
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(0, jitter))
+            await asyncio.sleep(delay)
 
-    raise RuntimeError(f"Gemini API failed after 3 attempts: {last_error}")
+    raise RuntimeError(f"Gemini API failed after {max_retries} attempts: {last_error}")
 
 
-async def analyze_image(image_base64: str, object_info: dict | None = None) -> dict:
-    """Analyze a camera image and generate a battle character.
+def init_client(api_key: str):
+    # Single module-level client: the SDK keeps one pooled httpx
+    # AsyncClient per Client, so every Gemini call from every connection
+    # reuses the same TLS sessions
+    global client
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            timeout=30_000,
+            # Explicit pool sizing + HTTP/2 so concurrent calls from many
+            # WebSocket clients multiplex over kept-alive TLS sessions
+            # instead of paying a handshake each
+            async_client_args={
+                "http2": True,
+                "limits": httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=50,
+                ),
+            },
+        ),
+    )
 
-    If object_info is provided (from analyze_object), it will be used as
-    context to generate a character that reflects the detected weapon.
-    """
+
+async def warmup():
+    """Issue a tiny generation so the first player doesn't pay the one-time
+    TLS handshake and auth discovery. Best effort — failures are ignored."""
     if client is None:
-        raise RuntimeError("Gemini client not initialized")
+        return
+    try:
+        await client.aio.models.generate_content(
+            model=MODEL,
+            contents="ok",
+            config=types.GenerateContentConfig(
+                max_output_tokens=1,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+    except Exception:
+        pass
+
+
+async def close_client():
+    """Close the shared client's pooled connections. Called on shutdown."""
+    global client
+    if client is not None:
+        await client.aio.aclose()
+        client = None
 
-    # Strip data URL prefix if present
-    if "," in image_base64:
-        image_base64 = image_base64.split(",", 1)[1]
-
-    image_bytes = base64.b64decode(image_base64)
-
-    if object_info:
-        object_name = object_info.get("object_name", "不明な物体")
-        attribute = object_info.get("attribute", "打撃")
-        power = object_info.get("power", 50)
-
-        prompt = f"""この画像に写っている物体は「{object_name}」と鑑定されました。
-武器としての属性は【{attribute}】、パワーは【{power}/100】です。
-
-この鑑定結果を元に、バトルゲームのキャラクターを生成してください。
-- キャラクターの名前は「{object_name}」をベースにした創造的な名前にしてください
-- 属性【{attribute}】を活かした必殺技にしてください
-- パワー{power}を反映したステータス配分にしてください（パワーが高いほど強い）
-- キャラクターの説明には、元の物体と属性について触れてください
-
-以下のJSON形式で出力してください:
-{{
-  "name": "キャラクター名（日本語）",
-  "hp": 数値(50-200),
-  "attack": 数値(10-100),
-  "defense": 数値(10-100),
-  "speed": 数値(10-100),
-  "special_move": "必殺技名（日本語）",
-  "attribute": "{attribute}",
-  "power": {power},
-  "description": "キャラクターの説明（2-3文、日本語）"
-}}
-
-ステータスの合計は250-400の範囲にしてください。"""
-    else:
-        prompt = """この画像に写っているものを元に、バトルゲームのキャラクターを生成してください。
-画像の内容を創造的に解釈して、ユニークで面白いキャラクターにしてください。
-
-以下のJSON形式で出力してください:
-{
-  "name": "キャラクター名（日本語）",
-  "hp": 数値(50-200),
-  "attack": 数値(10-100),
-  "defense": 数値(10-100),
-  "speed": 数値(10-100),
-  "special_move": "必殺技名（日本語）",
-  "description": "キャラクターの説明（2-3文、日本語）"
-}
-
-ステータスの合計は250-400の範囲にしてください。画像の特徴に合ったステータス配分にしてください。"""
 
-    last_error = None
-    for attempt in range(3):
-        try:
-            response = await client.aio.models.generate_content(
-                model=MODEL,
-                contents=[
-                    types.Content(
-                        parts=[
-                            types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
-                            types.Part.from_text(text=prompt),
-                        ]
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.9,
-                ),
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            last_error = e
-            if attempt < 2:
-                await asyncio.sleep(1)
+async def analyze_image_and_object(image_bytes: bytes) -> dict:
+    """Analyze a camera image and generate a battle character in one call.
 
-    raise RuntimeError(f"Gemini API failed after 3 attempts: {last_error}")
+    Takes the raw JPEG bytes and performs the object appraisal (attribute
+    & power) and the character generation that used to be two sequential
+    Gemini requests as a single multimodal request, returning both JSON
+    blocks together: {"object_name", "attribute", "power", "character": {...}}.
+
+    Results are cached by image hash, so resubmitting an identical image
+    skips the Gemini round-trip; concurrent duplicates coalesce into one
+    in-flight request.
+    """
+    key = hashlib.blake2b(image_bytes, digest_size=8).digest()
+
+    # Callers mutate the returned dict (the illustration data-URL gets
+    # written into character["image"]), so hand out copies: the cache must
+    # stay analysis-sized and each player needs an independent character
+    cached = _analysis_cache.get(key)
+    if cached is not None:
+        _analysis_cache.move_to_end(key)
+        return copy.deepcopy(cached)
+
+    inflight = _analysis_inflight.get(key)
+    if inflight is not None:
+        return copy.deepcopy(await inflight)
+
+    fut = asyncio.get_running_loop().create_future()
+    _analysis_inflight[key] = fut
+    try:
+        result = await _analyze_image_and_object(image_bytes)
+        _analysis_cache[key] = copy.deepcopy(result)
+        if len(_analysis_cache) > _ANALYSIS_CACHE_MAX:
+            _analysis_cache.popitem(last=False)
+        fut.set_result(result)
+        return result
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved for callers that never await
+        raise
+    finally:
+        _analysis_inflight.pop(key, None)
+        if not fut.done():
+            # Leader was cancelled mid-call; wake any followers with a
+            # normal (catchable) error rather than cancelling them —
+            # their handlers only catch Exception
+            fut.set_exception(RuntimeError("coalesced request cancelled"))
+            fut.exception()
+
+
+async def _analyze_image_and_object(image_bytes: bytes) -> dict:
+    if client is None:
+        raise RuntimeError("Gemini client not initialized")
+
+    try:
+        image_bytes = await asyncio.to_thread(_normalize_image, image_bytes)
+    except Exception:
+        pass  # send the original bytes if normalization fails
+
+    async def attempt():
+        response = await client.aio.models.generate_content(
+            model=MODEL,
+            contents=[
+                types.Content(
+                    parts=[
+                        # Stable prompt text first, image last: identical
+                        # leading tokens across calls let Gemini's implicit
+                        # prefix cache kick in
+                        types.Part.from_text(text=_ANALYZE_PROMPT),
+                        types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
+                    ]
+                )
+            ],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=ObjectAnalysis,
+                temperature=0.9,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+        return _parse_and_validate(
+            response.text, required_keys=("attribute", "power", "character")
+        )
+
+    return await _retry(attempt, gate=_text_gate)
 
 
 async def generate_character_image(character: dict) -> str:
-    """Generate a character illustration and return as base64 data URL."""
+    """Generate a character illustration and return as base64 data URL.
+
+    Concurrent requests for the same character coalesce onto a single
+    in-flight image-generation call, keyed by a hash of the character
+    fields — this is the most expensive Gemini call in the service. A
+    semantic cache additionally reuses an existing illustration when a
+    character's fields embed close (cosine > 0.95) to one already drawn.
+    """
+    key = hashlib.blake2b(
+        orjson.dumps(character, option=orjson.OPT_SORT_KEYS),
+        digest_size=8,
+    ).digest()
+
+    inflight = _image_inflight.get(key)
+    if inflight is not None:
+        return await inflight
+
+    # Register the future before any await so concurrent callers coalesce
+    # onto this leader; the embed + semantic lookup run inside it
+    fut = asyncio.get_running_loop().create_future()
+    _image_inflight[key] = fut
+    try:
+        # The embedding call is ~100ms against a multi-second image
+        # generation; on a semantic hit, followers get the cached image too
+        embedding = await _embed_character(character)
+        if embedding is not None:
+            cached = _image_cache_lookup(embedding)
+            if cached is not None:
+                fut.set_result(cached)
+                return cached
+
+        result = await _generate_character_image(character)
+        if embedding is not None:
+            _image_cache_put(key, embedding, result)
+        fut.set_result(result)
+        return result
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved for callers that never await
+        raise
+    finally:
+        _image_inflight.pop(key, None)
+        if not fut.done():
+            # Leader was cancelled mid-call; wake any followers with a
+            # normal (catchable) error rather than cancelling them —
+            # their handlers only catch Exception
+            fut.set_exception(RuntimeError("coalesced request cancelled"))
+            fut.exception()
+
+
+async def _generate_character_image(character: dict) -> str:
     if client is None:
         raise RuntimeError("Gemini client not initialized")
 
@@ -169,34 +445,36 @@ async def generate_character_image(character: dict) -> str:
 必殺技: {character['special_move']}
 説明: {character['description']}
 
-【絶対に守るルール】
-- 文字、テキスト、ロゴ、名前、数字、記号は一切描かないでください
-- キャラクターのみを描いてください
-- 背景はシンプルな単色グラデーションにしてください
-- アニメ・ゲーム風の迫力あるポーズで描いてください
-- 正方形の構図で、キャラクターを画面中央に大きく配置してください"""
-
-    last_error = None
-    for attempt in range(3):
-        try:
-            response = await client.aio.models.generate_content(
-                model=IMAGE_MODEL,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_modalities=["IMAGE", "TEXT"],
-                ),
-            )
-            for part in response.candidates[0].content.parts:
+{_IMAGE_PROMPT_RULES}"""
+
+    async def attempt():
+        # Stream so we can return on the first image chunk instead of
+        # waiting for the trailing TEXT part we discard anyway
+        stream = await client.aio.models.generate_content_stream(
+            model=IMAGE_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                response_modalities=["IMAGE", "TEXT"],
+            ),
+        )
+        async for chunk in stream:
+            if not chunk.candidates or chunk.candidates[0].content is None:
+                continue
+            for part in chunk.candidates[0].content.parts or []:
                 if part.inline_data:
-                    img_b64 = base64.b64encode(part.inline_data.data).decode()
-                    return f"data:{part.inline_data.mime_type};base64,{img_b64}"
-            raise RuntimeError("No image in response")
-        except Exception as e:
-            last_error = e
-            if attempt < 2:
-                await asyncio.sleep(1)
+                    # Join as bytes and decode once; decoding the ~1MB
+                    # b64 payload first and re-copying it through an
+                    # f-string doubles the memory traffic
+                    data_url = b"".join((
+                        b"data:",
+                        part.inline_data.mime_type.encode("ascii"),
+                        b";base64,",
+                        base64.b64encode(part.inline_data.data),
+                    ))
+                    return data_url.decode("ascii")
+        raise ValueError("No image in response")
 
-    raise RuntimeError(f"Image generation failed after 3 attempts: {last_error}")
+    return await _retry(attempt, gate=_image_gate)
 
 
 async def generate_random_character() -> dict:
@@ -204,49 +482,23 @@ async def generate_random_character() -> dict:
     if client is None:
         raise RuntimeError("Gemini client not initialized")
 
-    prompt = """ランダムなバトルゲームのキャラクターを1体生成してください。
-創造的でユニークなキャラクターにしてください。
-
-属性は必ず以下の4つの中から1つ選んでください:
-- 斬撃
-- 打撃
-- 盾
-- 毒
-
-以下のJSON形式で出力してください:
-{
-  "name": "キャラクター名（日本語）",
-  "hp": 数値(50-200),
-  "attack": 数値(10-100),
-  "defense": 数値(10-100),
-  "speed": 数値(10-100),
-  "special_move": "必殺技名（日本語）",
-  "attribute": "属性名",
-  "power": 数値(30-90),
-  "description": "キャラクターの説明（2-3文、日本語）"
-}
-
-ステータスの合計は250-400の範囲にしてください。"""
-
-    last_error = None
-    for attempt in range(3):
-        try:
-            response = await client.aio.models.generate_content(
-                model=MODEL,
-                contents=[types.Content(parts=[types.Part.from_text(text=prompt)])],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=1.2,
-                    thinking_config=types.ThinkingConfig(thinking_budget=0),
-                ),
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            last_error = e
-            if attempt < 2:
-                await asyncio.sleep(1)
-
-    raise RuntimeError(f"Random character generation failed after 3 attempts: {last_error}")
+    async def attempt():
+        response = await client.aio.models.generate_content(
+            model=MODEL,
+            contents=[types.Content(parts=[types.Part.from_text(text=_RANDOM_CHARACTER_PROMPT)])],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=Character,
+                temperature=1.2,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+        return _parse_and_validate(
+            response.text,
+            required_keys=("name", "hp", "attack", "defense", "speed", "special_move"),
+        )
+
+    return await _retry(attempt, gate=_text_gate)
 
 
 async def resolve_battle(character1: dict, character2: dict) -> dict:
@@ -284,28 +536,26 @@ HP: {character2['hp']}
 ステータスと属性の相性を考慮して、勝者を決定してください。
 属性の相性: 斬撃→盾に強い、打撃→斬撃に強い、盾→毒に強い、毒→打撃に強い
 
-以下のJSON形式で出力してください:
-{{
-  "winner": 1 または 2（勝者のプレイヤー番号）,
-  "reason": "勝敗の決め手（日本語、1文、熱い表現で）"
-}}"""
-
-    last_error = None
-    for attempt in range(3):
-        try:
-            response = await client.aio.models.generate_content(
-                model=MODEL,
-                contents=[types.Content(parts=[types.Part.from_text(text=prompt)])],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=1.0,
-                    thinking_config=types.ThinkingConfig(thinking_budget=0),
-                ),
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            last_error = e
-            if attempt < 2:
-                await asyncio.sleep(1)
-
-    raise RuntimeError(f"Gemini API failed after 3 attempts: {last_error}")
+winnerは勝者のプレイヤー番号（1または2）、reasonは勝敗の決め手（日本語、1文、熱い表現で）としてください。"""
+
+    cache_key = hashlib.sha256(f"{MODEL}|1.0|{prompt}".encode()).hexdigest()
+    cached = _response_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def attempt():
+        response = await client.aio.models.generate_content(
+            model=MODEL,
+            contents=[types.Content(parts=[types.Part.from_text(text=prompt)])],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=BattleResult,
+                temperature=1.0,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+        return _parse_and_validate(response.text, required_keys=("winner",))
+
+    result = await _retry(attempt, gate=_text_gate)
+    _response_cache_put(cache_key, result)
+    return result
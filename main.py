@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from fastapi import FastAPI, WebSocket
@@ -19,6 +20,16 @@ async def startup():
     if not api_key:
         raise RuntimeError("GEMINI_API_KEY is not set in .env")
     gemini_service.init_client(api_key)
+    try:
+        await asyncio.wait_for(gemini_service.warmup(), timeout=5.0)
+    except asyncio.TimeoutError:
+        pass  # don't hold up startup for the warm-up call
+    room_manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await gemini_service.close_client()
 
 
 app.mount("/static", StaticFiles(directory="static"), name="static")